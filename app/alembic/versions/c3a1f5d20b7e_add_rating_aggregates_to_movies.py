@@ -0,0 +1,50 @@
+"""add rating_count and rating_sum aggregates to movies
+
+Revision ID: c3a1f5d20b7e
+Revises: 95492db036f6
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a1f5d20b7e'
+down_revision: Union[str, None] = '95492db036f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# movies are backfilled by id range, each batch committed on its own, so the
+# backfill never holds locks on the whole table
+BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    op.add_column('movies', sa.Column('rating_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('movies', sa.Column('rating_sum', sa.Float(), nullable=False, server_default='0'))
+
+    conn = op.get_bind()
+    max_id = conn.execute(sa.text("SELECT max(id) FROM movies")).scalar()
+    if max_id is None:
+        return
+
+    backfill = sa.text(
+        """
+        UPDATE movies SET
+            rating_count = (SELECT count(*) FROM ratings WHERE ratings.movie_id = movies.id),
+            rating_sum = (SELECT coalesce(sum(rating), 0) FROM ratings WHERE ratings.movie_id = movies.id),
+            rating = (SELECT avg(rating) FROM ratings WHERE ratings.movie_id = movies.id)
+        WHERE id > :lo AND id <= :hi
+        """
+    )
+    with op.get_context().autocommit_block():
+        for lo in range(0, max_id, BATCH_SIZE):
+            conn.execute(backfill, {"lo": lo, "hi": lo + BATCH_SIZE})
+
+
+def downgrade() -> None:
+    op.drop_column('movies', 'rating_sum')
+    op.drop_column('movies', 'rating_count')
@@ -5,12 +5,13 @@ from typing import Optional
 from jose import JWTError, jwt
 from argon2 import PasswordHasher, exceptions
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
 from app.utils import  verify_password
-from app.database import SessionLocal, get_db
+from app.database import get_db
 import app.crud as crud
 
 
@@ -28,9 +29,9 @@ pwd_context = PasswordHasher()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = crud.get_user_by_username(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await crud.get_user_by_username(db, username)
+    if not user or not await run_in_threadpool(verify_password, password, user.hashed_password):
         return False
     return user
 
@@ -45,7 +46,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -58,7 +59,7 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    user = await crud.get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
     return user
@@ -2,89 +2,123 @@
 import app.models as models, app.schema as schema
 
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, select, update
 from sqlalchemy.sql import func
-from app.utils import hash_password 
-from sqlalchemy.orm import Session, joinedload
-
-
-
-# Movie CRUD operations with joinedload
-def get_movie(db: Session, id: int):
-    return db.query(models.Movie).options(
-        joinedload(models.Movie.ratings),
-        joinedload(models.Movie.comments).joinedload(models.Comment.replies)
-    ).filter(models.Movie.id == id).first()
-
-    
-def get_movie_by_publisher(db: Session, publisher: str):
-    return db.query(models.Movie).filter(models.Movie.publisher == publisher).first()
-
-def get_movie_by_title(db: Session, title: str):
-    return db.query(models.Movie).filter(models.Movie.title == title).first()
+from app.utils import hash_password
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from typing import Optional
+
+
+
+# Movie CRUD operations with eager loading; every relationship a response or
+# an ORM cascade touches has to be loaded up front, asyncio sessions can't
+# lazy load on attribute access
+async def get_movie(db: AsyncSession, id: int):
+    result = await db.execute(select(models.Movie).options(
+        joinedload(models.Movie.user),
+        selectinload(models.Movie.ratings),
+        selectinload(models.Movie.comments).selectinload(models.Comment.replies)
+    ).where(models.Movie.id == id))
+    return result.scalars().first()
+
+
+async def get_movie_by_publisher(db: AsyncSession, publisher: str):
+    result = await db.execute(select(models.Movie).where(models.Movie.publisher == publisher))
+    return result.scalars().first()
+
+async def get_movie_by_title(db: AsyncSession, title: str):
+    result = await db.execute(select(models.Movie).where(models.Movie.title == title))
+    return result.scalars().first()
+
+async def get_movie_by_rating(db: AsyncSession, movie_id: int):
+    result = await db.execute(select(models.Rating).where(models.Rating.movie_id == movie_id))
+    return result.scalars().all()
+
+def lean_movie_options():
+    # just the columns MovieResponseModel needs: the movie row and its owner,
+    # pulled in with a many-to-one join so LIMIT never has to be wrapped in
+    # a subquery the way it is for collection joins
+    return (
+        load_only(
+            models.Movie.id, models.Movie.title, models.Movie.genre, models.Movie.publisher,
+            models.Movie.year_published, models.Movie.rating, models.Movie.user_id,
+        ),
+        joinedload(models.Movie.user).load_only(
+            models.User.id, models.User.username, models.User.full_name, models.User.email,
+        ),
+    )
 
-def get_movie_by_rating(db: Session, movie_id: int):
-    return db.query(models.Rating).filter(models.Rating.movie_id == movie_id)
 
-def get_movies(db: Session, offset: int = 0, limit: int = 10):
-    return db.query(models.Movie).options(
-        joinedload(models.Movie.ratings),
-        joinedload(models.Movie.comments).joinedload(models.Comment.replies)
-    ).offset(offset).limit(limit).all()
+async def get_movies(db: AsyncSession, offset: int = 0, limit: int = 10, after_id: Optional[int] = None):
+    query = select(models.Movie).options(*lean_movie_options()).order_by(models.Movie.id)
+    # keyset mode: seek past the last id of the previous page instead of
+    # counting through `offset` rows, so deep pages cost the same as the first
+    if after_id is not None:
+        query = query.where(models.Movie.id > after_id)
+    else:
+        query = query.offset(offset)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
 
 
-def create_movie(db: Session, movie: schema.MovieCreate, user_id:int = None):
+async def create_movie(db: AsyncSession, movie: schema.MovieCreate, user_id:int = None):
     db_movie = models.Movie(**movie.model_dump(),
                 user_id = user_id)
     db.add(db_movie)
-    db.commit()
-    db.refresh(db_movie)
+    await db.commit()
+    await db.refresh(db_movie, ["rating", "user"])
     return db_movie
 
 
-def update_movie(db: Session, movie_id: int, movie_payload: schema.MovieUpdate, user_id:int = None):
-    movie = get_movie(db, movie_id)
+async def update_movie(db: AsyncSession, movie_id: int, movie_payload: schema.MovieUpdate, user_id:int = None):
+    movie = await get_movie(db, movie_id)
     if not movie:
         return None
-    
+
     if movie.user_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to update this movie")
-    
-    movie_payload_dict = movie_payload.dict(exclude_unset=True)
+
+    movie_payload_dict = movie_payload.model_dump(exclude_unset=True)
 
     for k, v in movie_payload_dict.items():
         setattr(movie, k, v)
 
     db.add(movie)
-    db.commit()
-    db.refresh(movie)
+    await db.commit()
     return movie
 
 
-def delete_movie(db: Session, movie_id, user_id: int = None):
-    db_delete_movie = get_movie(db, movie_id)
+async def delete_movie(db: AsyncSession, movie_id, user_id: int = None):
+    db_delete_movie = await get_movie(db, movie_id)
     if not db_delete_movie:
         return None
 
-    
-    db.delete(db_delete_movie)
-    db.commit()
+
+    await db.delete(db_delete_movie)
+    await db.commit()
     return {'message': 'movie deleted successfully'}
 
 
 # user crud
-def get_user_by_username(db: Session,username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession,username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
 
+async def get_user_by_fullname(db: AsyncSession, full_name: str):
+    result = await db.execute(select(models.User).where(models.User.full_name == full_name))
+    return result.scalars().first()
 
-def get_user_by_fullname(db: Session, full_name: str):
-    return db.query(models.User).filter(models.User.full_name == full_name).first()
-    
 
-def create_user(db: Session, user: schema.UserCreate):
-    hashed_password = hash_password(user.password)
+async def create_user(db: AsyncSession, user: schema.UserCreate):
+    # argon2 is deliberately slow; keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, user.password)
     db_user = models.User(
         username = user.username,
         full_name = user.full_name,
@@ -92,140 +126,171 @@ def create_user(db: Session, user: schema.UserCreate):
         hashed_password = hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
 # new rating
-def create_rating(db: Session, rating: schema.RatingCreate, movie_id: int, user_id: int):
+async def create_rating(db: AsyncSession, rating: schema.RatingCreate, movie_id: int, user_id: int):
     # Check if the user has already rated this movie
-    existing_rating = db.query(models.Rating).filter(models.Rating.movie_id == movie_id, models.Rating.user_id == user_id).first()
-    
+    result = await db.execute(select(models.Rating.id).where(models.Rating.movie_id == movie_id, models.Rating.user_id == user_id))
+    existing_rating = result.first()
+
     if existing_rating:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"You have already rated movie_id {movie_id}")
-    
+
      # Check if the rating is within the acceptable range
     if rating.rating < 0 or rating.rating > 5.0:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=f"{rating} is invalid, Rating range should be from 0 to 5")
-       
+
     db_rating = models.Rating(**rating.model_dump(),
-                              movie_id=movie_id, 
+                              movie_id=movie_id,
                               user_id=user_id)
     db.add(db_rating)
-    db.commit()
-    db.refresh(db_rating) 
-    
-    update_movie_average_rating(db, movie_id)
-    return db_rating
+    await db.flush()
+    await apply_rating_delta(db, movie_id, rating.rating, 1)
+    await db.commit()
+    return await get_rating_by_id(db, db_rating.id)
+
+
+async def apply_rating_delta(db: AsyncSession, movie_id: int, value: float, count: int):
+    # move the movie aggregates by one rating (count=1 adds, count=-1 removes)
+    # in a single UPDATE, so it runs in the caller's transaction and never
+    # has to read the movie's ratings back
+    new_count = models.Movie.rating_count + count
+    new_sum = models.Movie.rating_sum + count * value
+    result = await db.execute(
+        update(models.Movie)
+        .where(models.Movie.id == movie_id)
+        .values(
+            rating_count=new_count,
+            rating_sum=case((new_count > 0, new_sum), else_=0.0),
+            rating=case((new_count > 0, new_sum / new_count), else_=None),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Movie not found")
 
 
-def update_movie_average_rating(db: Session, movie_id: int):
-    movie = db.query(models.Movie).filter(models.Movie.id == movie_id).first()
+async def update_movie_average_rating(db: AsyncSession, movie_id: int):
+    # full recompute from the ratings table, only needed to repair drift;
+    # the write paths use apply_rating_delta instead
+    result = await db.execute(select(
+        func.count(models.Rating.id), func.coalesce(func.sum(models.Rating.rating), 0.0)
+    ).where(models.Rating.movie_id == movie_id))
+    count, total = result.one()
+    movie = await db.get(models.Movie, movie_id)
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
-    
-    ratings = db.query(models.Rating).filter(models.Rating.movie_id == movie_id).all()
-    if ratings:
-        average_rating = sum(r.rating for r in ratings) / len(ratings)
-        movie.rating = round(average_rating, 2)
-        
-    else:
-        movie.rating = None
-    
-    movie.rating = average_rating
-    db.commit()
-    db.refresh(movie)
 
-# average_rating i cannot see the calcs in my db or docs tester
+    movie.rating_count = count
+    movie.rating_sum = total if count else 0.0
+    movie.rating = total / count if count else None
+    await db.commit()
+
+
+def rating_query():
+    # RatingResponseModel embeds both the movie and the user
+    return select(models.Rating).options(
+        joinedload(models.Rating.movie).load_only(
+            models.Movie.title, models.Movie.genre, models.Movie.publisher, models.Movie.year_published,
+        ),
+        joinedload(models.Rating.user),
+    )
+
 
-def get__rating_by_movie_id(db: Session, movie_id: int):
+async def get__rating_by_movie_id(db: AsyncSession, movie_id: int):
     # check if movie exist
-    movie = db.query(models.Movie).filter(models.Movie.id == movie_id).first()
+    movie = await db.get(models.Movie, movie_id)
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
     # filter all ratings in a movie
-    ratings = db.query(models.Rating).filter(models.Rating.movie_id == movie_id).all()
-    if ratings:
-        average_rating = sum(r.rating for r in ratings) / len(ratings)
-        movie.rating = round(average_rating, 2)
-    return ratings
-        
-
-def get_rating_by_id(db: Session, rating_id: int):
-    return db.query(models.Rating).filter(models.Rating.id == rating_id).first()
-
-def delete_rating(db: Session, rating_id: int, current_user: int = None):
-    db_rating = db.query(models.Rating).filter(models.Rating.id == rating_id).first()
+    result = await db.execute(rating_query().where(models.Rating.movie_id == movie_id))
+    return result.scalars().all()
+
+
+async def get_rating_by_id(db: AsyncSession, rating_id: int):
+    result = await db.execute(rating_query().where(models.Rating.id == rating_id))
+    return result.scalars().first()
+
+async def delete_rating(db: AsyncSession, rating_id: int, current_user: int = None):
+    db_rating = await db.get(models.Rating, rating_id)
     if db_rating:
-        movie_id = db_rating.movie_id
-        
-        db.delete(db_rating)
-        db.commit()
-        update_movie_average_rating(db, movie_id)
-        
+        await db.delete(db_rating)
+        await apply_rating_delta(db, db_rating.movie_id, db_rating.rating, -1)
+        await db.commit()
+
     else:
-        raise HTTPException(status_code=404, detail=f"Rating_id {rating_id} does not exist")   
+        raise HTTPException(status_code=404, detail=f"Rating_id {rating_id} does not exist")
     return {'message': 'successfully'}
 
 
 # comments --
-def create_comment(db:Session, payload:schema.CommentCreate, current_user: int, movie_id):
+async def create_comment(db:AsyncSession, payload:schema.CommentCreate, current_user: int, movie_id):
     db_comment = models.Comment(**payload.model_dump(),
                                 user_id=current_user,
                                 movie_id=movie_id
                              )
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return db_comment
+    await db.commit()
+    return await get_comment_by_id(db, db_comment.id)
 
 
 # reply
-def create_reply(db: Session, reply: schema.ReplyCreate, comment_id: int, current_user: int):
+async def create_reply(db: AsyncSession, reply: schema.ReplyCreate, comment_id: int, current_user: int):
     db_reply_comment = models.Reply(**reply.model_dump(),
                                     user_id = current_user,
                                     comment_id=comment_id
                                     )
     db.add(db_reply_comment)
-    db.commit()
-    db.refresh(db_reply_comment)
+    await db.commit()
+    await db.refresh(db_reply_comment)
     return db_reply_comment
 
-    
+
 # get comments and its replies
-def get_comments(db: Session, movie_id: int ):
+async def get_comments(db: AsyncSession, movie_id: int ):
      # Fetch the movie with its comments and their replies
-    movie_with_comments = db.query(models.Movie).options(joinedload(models.Movie.comments).joinedload(models.Comment.replies)
-    ).filter(models.Movie.id == movie_id).first()
-    return movie_with_comments
+    result = await db.execute(select(models.Movie).options(
+        selectinload(models.Movie.comments).options(
+            selectinload(models.Comment.replies),
+            joinedload(models.Comment.movie),
+        )
+    ).where(models.Movie.id == movie_id))
+    return result.scalars().first()
 
 # get comment by id
-def get_comment_by_id(db:Session, comment_id: int):
-    return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
+async def get_comment_by_id(db:AsyncSession, comment_id: int):
+    result = await db.execute(select(models.Comment).options(
+        joinedload(models.Comment.movie),
+        selectinload(models.Comment.replies),
+    ).where(models.Comment.id == comment_id))
+    return result.scalars().first()
 
-def get_reply_by_id(db: Session, reply_id: int):
-    return db.query(models.Reply).filter(models.Reply.id == reply_id).first()
+async def get_reply_by_id(db: AsyncSession, reply_id: int):
+    return await db.get(models.Reply, reply_id)
 
 
 # delete a comment
-def delete_comment(db: Session, comment_id: int, current_user: int = None):
-    db_delete_comment = get_comment_by_id(db, comment_id=comment_id)
+async def delete_comment(db: AsyncSession, comment_id: int, current_user: int = None):
+    db_delete_comment = await get_comment_by_id(db, comment_id=comment_id)
     if not db_delete_comment:
         return None
-    
-    db.delete(db_delete_comment)
-    db.commit()
+
+    await db.delete(db_delete_comment)
+    await db.commit()
     return {'message': 'success'}
 
 
 # delete reply
-def delete_reply(db: Session, reply_id: int, current_user: int = None):
-    db_delete_reply = get_reply_by_id(db, reply_id=reply_id)
+async def delete_reply(db: AsyncSession, reply_id: int, current_user: int = None):
+    db_delete_reply = await get_reply_by_id(db, reply_id=reply_id)
     if not db_delete_reply:
         raise HTTPException(status_code=404, detail="reply not found")
         # return None
-    
-    db.delete(db_delete_reply)
-    db.commit()
+
+    await db.delete(db_delete_reply)
+    await db.commit()
     return {'message': 'success'}
@@ -1,19 +1,28 @@
 import app.crud as crud, app.schema as schema
 import app.models 
-from fastapi import Depends, FastAPI, HTTPException, APIRouter, status
+from fastapi import Depends, FastAPI, HTTPException, APIRouter, Query, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from app.auth import authenticate_user, create_access_token, get_current_user
-from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import engine, Base, get_db
-from typing import List
+from typing import List, Optional
 # from app.models import Movie, Rating
 from app.logger import get_logger
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
 
 logger = get_logger(__name__)
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # routers
 user_router = APIRouter(prefix="", tags=["users"])
@@ -23,11 +32,11 @@ comments_router = APIRouter(prefix="/comments", tags=["comments"])
 
 
 @user_router.post("/signup")
-def signup(user: schema.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schema.UserCreate, db: AsyncSession = Depends(get_db)):
     logger.info('Creating user...')
-    db_user = crud.get_user_by_username(db, username=user.username)
-    db_user_by_email = crud.get_user_by_email(db, email=user.email)
-    db_user_by_fullname = crud.get_user_by_fullname(db, full_name=user.full_name)
+    db_user = await crud.get_user_by_username(db, username=user.username)
+    db_user_by_email = await crud.get_user_by_email(db, email=user.email)
+    db_user_by_fullname = await crud.get_user_by_fullname(db, full_name=user.full_name)
     if db_user:
         logger.error(f"user trying to register but username entered already exist: {user.username}")
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -38,12 +47,12 @@ def signup(user: schema.UserCreate, db: Session = Depends(get_db)):
         logger.error(f"User trying to register but email entered already exists: {user.full_name}")
         raise HTTPException(status_code=400, detail="Fullname already registered")
     logger.info('User successfully created.')
-    return crud.create_user(db=db, user=user)
+    return await crud.create_user(db=db, user=user)
 
 
 @user_router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -56,19 +65,32 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 @movie_router.get("/", status_code=status.HTTP_200_OK, response_model=List[schema.MovieResponseModel])
-def get_movies(db: Session = Depends(get_db),  offset: int = 0, limit: int = 10):
-    movies = crud.get_movies(
+async def get_movies(response: Response,
+                     db: AsyncSession = Depends(get_db),
+                     offset: int = Query(0, ge=0),
+                     limit: int = Query(10, ge=1, le=100),
+                     cursor: Optional[str] = None):
+    after_id = None
+    if cursor:
+        after_id = decode_cursor(cursor)[0]
+        if not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    movies = await crud.get_movies(
         db, 
         offset=offset, 
-        limit=limit
+        limit=limit,
+        after_id=after_id
     )
+    # a full page means there may be more; hand back where to resume from
+    if len(movies) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(movies[-1].id)
     logger.info('lists of all movies')
     return movies
 
 
 @movie_router.get("/{movie_id}", status_code=status.HTTP_200_OK, response_model=schema.MovieResponseModel)
-def get_movie(movie_id: str, db: Session = Depends(get_db)):
-    movie = crud.get_movie(db, movie_id)
+async def get_movie(movie_id: int, db: AsyncSession = Depends(get_db)):
+    movie = await crud.get_movie(db, movie_id)
     logger.warning('movie not found')
     if not movie:
         raise HTTPException(status_code=404, detail="movie not found")
@@ -77,8 +99,8 @@ def get_movie(movie_id: str, db: Session = Depends(get_db)):
 
 
 @movie_router.post('/', status_code=status.HTTP_201_CREATED, response_model=schema.MovieResponseModel)
-def create_movie(payload: schema.MovieCreate, user: schema.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = crud.create_movie(
+async def create_movie(payload: schema.MovieCreate, user: schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await crud.create_movie(
         db, 
         payload,
         user_id=user.id
@@ -88,8 +110,8 @@ def create_movie(payload: schema.MovieCreate, user: schema.User = Depends(get_cu
 
 
 @movie_router.put('/{movie_id}', status_code=status.HTTP_201_CREATED, response_model=schema.MovieResponseModel)
-def update_movie(movie_id: int, payload: schema.MovieUpdate, user: schema.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = crud.update_movie(db, movie_id, payload, user.id)
+async def update_movie(movie_id: int, payload: schema.MovieUpdate, user: schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await crud.update_movie(db, movie_id, payload, user.id)
     logger.warning('movie not found')
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
@@ -99,8 +121,8 @@ def update_movie(movie_id: int, payload: schema.MovieUpdate, user: schema.User =
 
 
 @movie_router.delete('/{movie_id}')
-def delete_movie(movie_id: str, user: schema.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = crud.get_movie(db, movie_id)
+async def delete_movie(movie_id: int, user: schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await crud.get_movie(db, movie_id)
     if not movie:
         logger.warning('movie not found')
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Movie not found")
@@ -109,14 +131,14 @@ def delete_movie(movie_id: str, user: schema.User = Depends(get_current_user), d
         logger.warning(f'User {user.id} attempted to delete a movie they do not own')
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail=f'You are not permitted to delete this movie: {movie.title}')
     
-    crud.delete_movie(db, movie_id, user.id)
+    await crud.delete_movie(db, movie_id, user.id)
     logger.info(f'movie {movie_id} deleted')
     return {'message': f'movie {movie_id} deleted successfully'}
 
 # rating endpoint
 @rating_router.post('/{movie_id}', response_model=schema.RatingResponseModel)
-def create_rating(payload: schema.RatingCreate, movie: schema.Movie = Depends(get_movie), user: schema.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    rating = crud.create_rating(
+async def create_rating(payload: schema.RatingCreate, movie: schema.Movie = Depends(get_movie), user: schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    rating = await crud.create_rating(
         db,
         payload,
         movie_id = movie.id,
@@ -127,12 +149,12 @@ def create_rating(payload: schema.RatingCreate, movie: schema.Movie = Depends(ge
 
 
 @rating_router.get('/{movie_id}/rate', response_model=List[schema.RatingResponseModel])
-def get_rating_by_movie(movie_id: int, db: Session = Depends(get_db)):
-    movie = crud.get_movie(db, movie_id)
+async def get_rating_by_movie(movie_id: int, db: AsyncSession = Depends(get_db)):
+    movie = await crud.get_movie(db, movie_id)
     if not movie:
         logger.warning('movie not found')
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='movie not found')
-    ratings = crud.get__rating_by_movie_id(db,
+    ratings = await crud.get__rating_by_movie_id(db,
                                  movie_id
                                   )
     logger.info('list of ratings for a movie')
@@ -141,55 +163,54 @@ def get_rating_by_movie(movie_id: int, db: Session = Depends(get_db)):
 
 # delete rating
 @rating_router.delete('/{rating_id}')
-def delete_rating(rating_id: int, db: Session = Depends(get_db), current_user:schema.User = Depends(get_current_user)):
-    existing_rating = crud.get_rating_by_id(db, rating_id)
+async def delete_rating(rating_id: int, db: AsyncSession = Depends(get_db), current_user:schema.User = Depends(get_current_user)):
+    existing_rating = await crud.get_rating_by_id(db, rating_id)
     if not existing_rating:
         logger.error('rating not found')
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='rating not found')
     logger.info('rating deleted')
-    crud.delete_rating(db, rating_id, current_user.id)
+    await crud.delete_rating(db, rating_id, current_user.id)
     return {'message': 'rating deleted successfully'}
 
 
 # comments, response_model=schema.CommentResponse
 @comments_router.post('/', response_model=schema.CommentResponse)
-def create_comment(comment: schema.CommentCreate, 
-                   movie_id: int = 1, 
-                   current_user: schema.User = Depends(get_current_user), 
-                   db: Session = Depends(get_db)):
-    movie = crud.get_movie(db, movie_id)
+async def create_comment(comment: schema.CommentCreate, 
+                         movie_id: int = 1, 
+                         current_user: schema.User = Depends(get_current_user), 
+                         db: AsyncSession = Depends(get_db)):
+    movie = await crud.get_movie(db, movie_id)
     if not movie:
         logger.warning('movie not found')
         raise HTTPException(status_code=404, detail="Movie not found")
-    db_comment = crud.create_comment(db, comment, current_user.id, movie_id)
+    db_comment = await crud.create_comment(db, comment, current_user.id, movie_id)
     logger.info('comment created successfully')
     return db_comment
 
 
 # create reply
 @comments_router.post('/{comment_id}/replies', response_model=schema.CommentResponse)
-def create_reply(payload: schema.ReplyCreate, comment_id:int, current_user: schema.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db_comment = crud.get_comment_by_id(db, comment_id)
+async def create_reply(payload: schema.ReplyCreate, comment_id:int, current_user: schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    db_comment = await crud.get_comment_by_id(db, comment_id)
     if not db_comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     logger.info('Replying comments.....')
-    reply = crud.create_reply(db, payload, comment_id, current_user.id)
+    reply = await crud.create_reply(db, payload, comment_id, current_user.id)
     db_comment.replies.append(reply)
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
+    await db.commit()
     return db_comment
 
 
 # to get comments for a post, including nested replies
 @comments_router.get('/{movie_id}/comments', response_model=schema.MovieCommentResponseModel)
-def get_comments(movie_id: int, db: Session = Depends(get_db)):
-    db_movie = crud.get_movie(db, movie_id)
+async def get_comments(movie_id: int, db: AsyncSession = Depends(get_db)):
+    db_movie = await crud.get_movie(db, movie_id)
     if not db_movie:
         logger.warning('movie not found.....')
         raise HTTPException(status_code=404, detail="Movie not found")
     logger.info('getting comments and replys if available...')
-    comments = crud.get_comments(db, movie_id)
+    comments = await crud.get_comments(db, movie_id)
     
     if not comments:
         logger.warning('comment not found.....')
@@ -198,24 +219,24 @@ def get_comments(movie_id: int, db: Session = Depends(get_db)):
     return comments
 
 @comments_router.delete('/{comment_id}')
-def delete_comment(comment_id: int, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
-    comment = crud.get_comment_by_id(db, comment_id)
+async def delete_comment(comment_id: int, db: AsyncSession = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    comment = await crud.get_comment_by_id(db, comment_id)
     logger.warning('comment not found')
     if not comment:
         raise HTTPException(status_code=404, detail="comment not found")
     logger.info('comment deleted')
-    crud.delete_comment(db, comment_id, current_user.id)
+    await crud.delete_comment(db, comment_id, current_user.id)
     return {'message': 'comment deleted successfuly'}
 
 # reply delete
 @comments_router.delete('/replies/{reply_id}/')
-def delete_reply(reply_id: int, db: Session = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
-    reply = crud.get_reply_by_id(db, reply_id=reply_id)
+async def delete_reply(reply_id: int, db: AsyncSession = Depends(get_db), current_user: schema.User = Depends(get_current_user)):
+    reply = await crud.get_reply_by_id(db, reply_id=reply_id)
     if not reply:
         logger.warning(f"Reply with id {reply_id} not found.....")
         raise HTTPException(status_code=404, detail="reply not found...")
     logger.info('reply deleted')
-    crud.delete_reply(db, reply_id, current_user.id)
+    await crud.delete_reply(db, reply_id, current_user.id)
     return {'message': 'reply deleted successfuly'}
 
 
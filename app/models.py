@@ -36,8 +36,11 @@ class Movie(Base):
     genre = Column(String, nullable=False)
     publisher = Column(String, nullable=False)
     
-    # this is the average rating of all ratings
+    # this is the average rating of all ratings, kept in step with
+    # rating_sum / rating_count on every rating write
     rating = Column(Float, nullable=True)
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Float, nullable=False, default=0.0, server_default="0")
     
     year_published = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
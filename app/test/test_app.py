@@ -1,9 +1,10 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from app import models
 from app.main import app, get_db
-from sqlalchemy import StaticPool, create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from app.database import Base
 from argon2 import PasswordHasher
 # from app import schema
@@ -12,22 +13,24 @@ from fastapi import status
 
 
 
-# Using in-memory SQLite for tests
-SQLALCHEMY_DATABASE_URL = "sqlite:///"
+# Using in-memory SQLite for tests, through aiosqlite
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, 
-                       connect_args={"check_same_thread": False}, 
-                       poolclass=StaticPool,)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, 
+                             connect_args={"check_same_thread": False}, 
+                             poolclass=StaticPool,)
+TestingSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
 
-Base.metadata.create_all(bind=engine)
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def run_metadata(method):
+    async with engine.begin() as conn:
+        await conn.run_sync(method)
+
+asyncio.run(run_metadata(Base.metadata.create_all))
+
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
@@ -36,10 +39,10 @@ client = TestClient(app)
 
 @pytest.fixture(scope="module")
 def setup_db():
-    Base.metadata.create_all(bind=engine)
+    asyncio.run(run_metadata(Base.metadata.create_all))
     
     yield
-    Base.metadata.drop_all(bind=engine)
+    asyncio.run(run_metadata(Base.metadata.drop_all))
 
 
 # Test successful signup
@@ -68,3 +71,63 @@ def test_login(setup_db):
 
 
 
+def auth_headers(username="testuser", password="testpassword"):
+    response = client.post("/login", data={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+# rating aggregates are kept on the movie row
+def test_rating_updates_movie_average(setup_db):
+    headers = auth_headers()
+    movie = client.post("/movies/", headers=headers, json={
+        "title": "Heat",
+        "genre": "crime",
+        "publisher": "Warner Bros",
+        "year_published": 1995
+    }).json()
+    assert movie["rating"] is None
+
+    first = client.post(f"/ratings/{movie['id']}", headers=headers, json={"rating": 4.0})
+    assert first.status_code == 200
+
+    client.post("/signup", json={
+        "username": "seconduser",
+        "full_name": "Second User",
+        "email": "seconduser@example.com",
+        "password": "testpassword"
+    })
+    second = client.post(f"/ratings/{movie['id']}", headers=auth_headers("seconduser"), json={"rating": 3.0})
+    assert second.status_code == 200
+    assert client.get(f"/movies/{movie['id']}").json()["rating"] == 3.5
+
+    client.delete(f"/ratings/{second.json()['id']}", headers=headers)
+    assert client.get(f"/movies/{movie['id']}").json()["rating"] == 4.0
+
+    client.delete(f"/ratings/{first.json()['id']}", headers=headers)
+    assert client.get(f"/movies/{movie['id']}").json()["rating"] is None
+
+
+# cursor pagination walks the catalog in id order without offsets
+def test_movies_keyset_pagination(setup_db):
+    headers = auth_headers()
+    for i in range(5):
+        client.post("/movies/", headers=headers, json={
+            "title": f"Movie {i}",
+            "genre": "drama",
+            "publisher": "A24",
+            "year_published": 2000 + i
+        })
+    everything = [m["id"] for m in client.get("/movies/", params={"limit": 100}).json()]
+
+    seen = []
+    response = client.get("/movies/", params={"limit": 2})
+    while True:
+        seen.extend(m["id"] for m in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        response = client.get("/movies/", params={"limit": 2, "cursor": cursor})
+    assert seen == everything
+    assert client.get("/movies/", params={"limit": 1}).json()[0]["user"]["username"] == "testuser"
+
+    assert client.get("/movies/", params={"cursor": "not-a-cursor"}).status_code == 400